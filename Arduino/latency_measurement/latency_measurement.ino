@@ -22,6 +22,8 @@ unsigned int i;
 const unsigned int RANDOM_DELAY_MIN = 1000;
 const unsigned int RANDOM_DELAY_MAX = 2000;
 const unsigned int CALIBRATION_SAMPLES = 10;
+// analogRead() takes about 112us, so this is about 5 seconds of waiting for the light
+const unsigned long WAIT_REPORT_READS = 44000;
 
 
 const int s_IDLE = 0;
@@ -244,10 +246,18 @@ void processSerial() {
 }
 
 unsigned long takeMeasurement() {
+  unsigned long reads;
   do {
     LED_ON();
+    reads = 0;
     start = micros();
-    while(analogRead(PHOTO_PIN) < threshold);
+    while(analogRead(PHOTO_PIN) < threshold) {
+      // Tell the host we are alive but the phototransistor does not see the light,
+      // so it does not mistake the silence for a lost connection
+      if(++reads % WAIT_REPORT_READS == 0) {
+        Serial.println("wait");
+      }
+    }
     end = micros();
     LED_OFF();
   } while(start > end); // Repeat the measuremtn if case the timer overflowed
@@ -270,6 +280,10 @@ void loop() {
     delay(100);
   }
   else if (state == s_MEASUREMENT) {
+    // Heartbeat, lets the host estimate the drift of the micros() clock. Sent before the
+    // measurement, while the host is idle, so it is timestamped as soon as it arrives
+    Serial.print("hb ");
+    Serial.println(micros());
     double reading = takeMeasurement();
     measurements[current++] = reading;
     Serial.println(reading/1000);
@@ -5,13 +5,23 @@ import argparse
 import signal
 import time
 import serial, serial.tools.list_ports
+from serial import SerialException
 import csv
+import json
 import numpy as np
 import matplotlib.pyplot as plt
 from pathlib import Path
 from dataclasses import dataclass
 from typing import List
 
+from G2GDelay.changepoint import ChangePoint, CusumDetector, print_segment_stats, segment_labels
+from G2GDelay.clock import MICROS_WRAP, ClockDriftEstimator
+
+
+RECONNECT_INTERVAL = 5  # seconds between attempts to find the Arduino again
+MAX_EMPTY_READS = 3  # consecutive readline() timeouts before the link is considered lost
+METADATA_INTERVAL = 10  # seconds between updates of the metadata file during a run
+
 
 @dataclass
 class Stats:
@@ -23,6 +33,14 @@ class Stats:
     std_dev: float
 
 
+@dataclass
+class Capture:
+    measurements: List[float]  # as reported by the Arduino, not corrected for clock drift
+    change_points: List[ChangePoint]
+    clock: ClockDriftEstimator
+    serial: serial.Serial
+
+
 
 def parse_arguments():
     parser = argparse.ArgumentParser(
@@ -85,6 +103,32 @@ def parse_arguments():
         type=float,
         help="The time in seconds the light is on. 0 means until stopped",
     )
+    parser.add_argument(
+        "-changepoint_threshold",
+        "-cpt",
+        nargs="?",
+        default=10.0,
+        type=float,
+        help="CUSUM alarm threshold (in standard deviations) for flagging level shifts during a run. "
+        "Variance changes use 1.5 times this value. 0 disables change-point detection. Default is 10, "
+        "which gives about 1 false alarm per 20000 to 50000 samples on stationary data; lower values react faster "
+        "to small shifts but raise more false alarms.",
+    )
+    parser.add_argument(
+        "-changepoint_warmup",
+        "-cpw",
+        nargs="?",
+        default=50,
+        type=int,
+        help="Number of samples used to estimate the reference level at the start of each segment, before "
+        "changes are flagged. The reference keeps being refined during the segment. Default is 50.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted run: keep the samples already saved in the CSV file and only collect the "
+        "remaining ones. The interruption is recorded as a gap in the change points file.",
+    )
 
     args = parser.parse_args()
     if args.filename.suffix != ".csv":
@@ -104,61 +148,224 @@ def find_arduino_on_serial_port() -> serial.Serial:
     raise ConnectionRefusedError("Did not find Arduino on any serial port. Is it connected?")
 
 
+def connect_arduino(args) -> serial.Serial:
+    serial = find_arduino_on_serial_port()
+    print("Warmup serial (3 sec)")
+    time.sleep(3)
+
+    if args.calibrate:
+        print("\nCalibrating")
+        calibrate(serial, args.threshold_offset)
+
+    return serial
+
+
+def reconnect_arduino(serial: serial.Serial, args) -> serial.Serial:
+    try:
+        serial.close()
+    except (SerialException, OSError):
+        pass
+
+    while True:
+        try:
+            return connect_arduino(args)
+        except (ConnectionRefusedError, SerialException, OSError) as e:
+            print(f"Reconnect failed: {e}")
+            print(f"Trying again in {RECONNECT_INTERVAL} seconds...")
+            time.sleep(RECONNECT_INTERVAL)
+
 
-def read_measurements_from_arduino(serial: serial.Serial, args) -> List[float]:
+def restart_measurement(serial: serial.Serial, args, num_measurements: int) -> serial.Serial:
+    """Reconnect and ask for the remaining measurements, until that goes through."""
+    while True:
+        serial = reconnect_arduino(serial, args)
+        try:
+            startMeasurement(serial, num_measurements)
+            return serial
+        except (SerialException, OSError) as e:
+            print(f"Lost connection to the Arduino again: {e}")
+
+
+def create_change_point_detector(args) -> CusumDetector:
+    # A threshold of 0 disables the alarms, but the detector still keeps track of gaps
+    threshold = args.changepoint_threshold if args.changepoint_threshold > 0 else float("inf")
+    return CusumDetector(
+        warmup=args.changepoint_warmup,
+        threshold=threshold,
+        var_threshold=1.5 * threshold,
+    )
+
+
+def change_points_file(csv_file: Path) -> Path:
+    return csv_file.with_name(csv_file.stem + "_changepoints.csv")
+
+
+def metadata_file(csv_file: Path) -> Path:
+    return csv_file.with_name(csv_file.stem + "_meta.json")
+
+
+def read_measurements_from_arduino(serial: serial.Serial, args) -> Capture:
     num_measurements = args.num_measurements
     quiet_mode = args.quiet
+    detector = create_change_point_detector(args)
+    clock = ClockDriftEstimator()
+
+    # Only the first capture of a session resumes, later ones from the menu start new runs
+    resume = args.resume
+    args.resume = False
+
+    if resume and args.filename.exists():
+        measurements = read_latencies_from_csv(args.filename)
+        change_points = []
+        if change_points_file(args.filename).exists():
+            change_points = read_change_points_from_csv(change_points_file(args.filename))
+        detector.restore(len(measurements), change_points)
+        if metadata_file(args.filename).exists():
+            clock = ClockDriftEstimator.from_dict(read_metadata(metadata_file(args.filename))["clock"])
+        if len(measurements) >= num_measurements:
+            print(f"{args.filename} already has {len(measurements)} measurements, nothing to resume")
+            return Capture(measurements, detector.change_points, clock, serial)
+        # Rewrite in the progressive format so the new samples can be appended
+        create_measurement_csv(args.filename)
+        append_measurement_to_csv(args.filename, measurements)
+        if measurements:
+            gap = detector.mark_gap(time.time())
+            append_change_point_to_csv(change_points_file(args.filename), gap)
+        print(f"Resuming {args.filename} at sample {len(measurements) + 1}")
+    else:
+        measurements = []
+        create_measurement_csv(args.filename)
+        change_points_file(args.filename).unlink(missing_ok=True)
+        metadata_file(args.filename).unlink(missing_ok=True)
 
     print(f"Collecting {num_measurements} measurements from the Arduino")
     if quiet_mode:
         print("Running in quiet mode, won't print the measurements to the terminal")
 
-    initMeasurement(serial, num_measurements)
-
-    # Read messages from Arduino
-    timeout = time.time() + 0.01
-    while True:
-        a = serial.readline().decode()
-        if time.time() > timeout:
-            break
-
-    measurements = []
-    i = 0
+    try:
+        startMeasurement(serial, num_measurements - len(measurements))
+    except (SerialException, OSError) as e:
+        print(f"Lost connection to the Arduino: {e}")
+        serial = restart_measurement(serial, args, num_measurements - len(measurements))
+
+    i = len(measurements)
+    # The metadata file is kept up to date during the run, so --resume can continue the clock fit
+    next_metadata = time.monotonic() + METADATA_INTERVAL
     overall_rounds = 0
     init_message = 0
+    empty_reads = 0
 
     try: 
         while i < num_measurements:
             overall_rounds += 1
-            a = serial.readline().decode()
-            if "." in a:
-                init_message = 1
-                i += 1
+            try:
+                a = read_line(serial)
+                received_ns = time.monotonic_ns()
+            except (SerialException, OSError) as e:
+                print(f"Lost connection to the Arduino: {e}")
+                empty_reads = MAX_EMPTY_READS
+                a = ""
+
+            if a.startswith("hb "):
+                # Heartbeat with the board's micros(), used to estimate the clock drift
+                empty_reads = 0
+                board_micros = parse_heartbeat(a)
+                if board_micros is not None:
+                    clock.update(board_micros, received_ns)
+                if time.monotonic() >= next_metadata:
+                    capture = Capture(measurements, detector.change_points, clock, serial)
+                    write_metadata(metadata_file(args.filename), capture)
+                    next_metadata = time.monotonic() + METADATA_INTERVAL
+            elif "." in a:
                 a = a.replace("\n", "")
                 a = a.replace("\r", "")
-                measurements.append(float(a))
+                try:
+                    latency = float(a)
+                except ValueError:
+                    # Garbage, e.g. boot noise of a board that was just reset
+                    continue
+                init_message = 1
+                empty_reads = 0
+                i += 1
+                measurements.append(latency)
                 append_measurement_to_csv(args.filename, [a])
                 if not quiet_mode:
                     print(f"[{i}/{num_measurements}]: {a} ms")
-            else:
-                if overall_rounds > 0 and init_message == 1:
+                change = detector.update(latency, time.time())
+                if change is not None:
+                    append_change_point_to_csv(change_points_file(args.filename), change)
                     print(
-                        "Did not receive msmt data from the Arduino for another 5 seconds. "
-                        "Is the phototransistor still sensing the LED?"
+                        f"Change point: {change.kind} shift {change.direction} from sample {change.sample + 1} "
+                        f"(detected at sample {change.detected_at + 1}), starting segment {change.segment}"
                     )
+            elif a.startswith("wait"):
+                # The board is alive but still waiting for the phototransistor to see the LED
+                empty_reads = 0
+                init_message = print_no_measurement_warning(init_message)
+            elif empty_reads >= MAX_EMPTY_READS - 1:
+                print(f"No response from the Arduino, reconnecting and resuming at sample {i + 1}...")
+                serial = restart_measurement(serial, args, num_measurements - i)
+                clock.new_epoch()
+                last = detector.change_points[-1] if detector.change_points else None
+                if last is not None and last.kind == "gap" and last.sample == i:
+                    # Still nothing measured since the last reconnect, it is the same interruption
+                    print(f"Reconnected, still in segment {last.segment}")
                 else:
-                    print(
-                        """Did not receive msmt data from the Arduino for 5 seconds.
-    Is the LED showing up on the screen?
-    Is the phototransistor pointing towards the screen?
-    Is the screen brightness high enough (max recommended)?"""
-                    )
-                    init_message = 1
+                    gap = detector.mark_gap(time.time())
+                    append_change_point_to_csv(change_points_file(args.filename), gap)
+                    print(f"Reconnected, starting segment {gap.segment}")
+                empty_reads = 0
+                init_message = 0
+            else:
+                empty_reads += 1
+                init_message = print_no_measurement_warning(init_message)
     except KeyboardInterrupt:
         print("Process interrupted by user, returning to main menu...")
         time.sleep(2)
 
-    return measurements
+    capture = Capture(measurements, detector.change_points, clock, serial)
+    write_metadata(metadata_file(args.filename), capture)
+    return capture
+
+
+def parse_heartbeat(line: str):
+    """micros() of a "hb <micros>" line, or None if the line was truncated or garbled."""
+    fields = line.split()
+    if len(fields) != 2:
+        return None
+    try:
+        board_micros = int(fields[1])
+    except ValueError:
+        return None
+    return board_micros if 0 <= board_micros < MICROS_WRAP else None
+
+
+def print_no_measurement_warning(init_message: int) -> int:
+    if init_message == 1:
+        print(
+            "Did not receive msmt data from the Arduino for another 5 seconds. "
+            "Is the phototransistor still sensing the LED?"
+        )
+    else:
+        print(
+            """Did not receive msmt data from the Arduino for 5 seconds.
+    Is the LED showing up on the screen?
+    Is the phototransistor pointing towards the screen?
+    Is the screen brightness high enough (max recommended)?"""
+        )
+    return 1
+
+
+def correct_clock_drift(measurements: List[float], clock: ClockDriftEstimator) -> List[float]:
+    if not clock.is_reliable():
+        print(f"Clock drift not corrected: {clock.heartbeats} heartbeats are not enough to estimate it")
+        return measurements
+
+    print(
+        f"Arduino clock drift: {clock.drift_ppm:+.0f} ppm (+/- {clock.rate_stderr * 1e6:.0f} ppm, "
+        f"{clock.heartbeats} heartbeats). Measurements corrected."
+    )
+    return [round(clock.correct(measurement), 3) for measurement in measurements]
 
 
 def write_measurements_to_csv(csv_file: Path, measurements: List[float], stats: Stats) -> None:
@@ -179,23 +386,85 @@ def write_measurements_to_csv(csv_file: Path, measurements: List[float], stats:
 
     print(f"Saved results to {csv_file}")
 
-def write_measurements_to_csv(csv_file: Path, measurements: List[float]) -> None:
+def write_measurements_to_csv(
+    csv_file: Path, measurements: List[float], segments: List[int] = None, raw: List[float] = None
+) -> None:
+    columns = {"latency": measurements}
+    if segments is not None:
+        columns["segment"] = segments
+    if raw is not None:
+        columns["latency_raw"] = raw
+
     with open(csv_file, "w", newline='') as f:
         writer = csv.writer(f)
-        writer.writerow(["latency"])
-        for measurement in measurements:
-            writer.writerow([measurement])
+        writer.writerow(list(columns))
+        writer.writerows(zip(*columns.values()))
 
     print(f"Saved results to {csv_file}")
+
+
+def write_metadata(json_file: Path, capture: Capture) -> None:
+    metadata = {
+        "samples": len(capture.measurements),
+        "change_points": len(capture.change_points),
+        "clock": capture.clock.to_dict(),
+    }
+    # Replaced in one step, so an interrupted write never leaves a broken file behind
+    tmp_file = json_file.with_name(json_file.name + ".tmp")
+    tmp_file.write_text(json.dumps(metadata, indent=2))
+    tmp_file.replace(json_file)
+
+
+def read_metadata(json_file: Path) -> dict:
+    return json.loads(json_file.read_text())
+
+
+def append_change_point_to_csv(csv_file: Path, change: ChangePoint) -> None:
+    new_file = not csv_file.exists()
+    with open(csv_file, "a", newline='') as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(["segment", "sample", "detected_at", "kind", "direction", "timestamp"])
+        writer.writerow(
+            [change.segment, change.sample, change.detected_at, change.kind, change.direction, change.timestamp]
+        )
+
+
+def read_change_points_from_csv(csv_file: Path) -> List[ChangePoint]:
+    with open(csv_file, "r", newline='') as f:
+        return [
+            ChangePoint(
+                int(row["sample"]),
+                int(row["detected_at"]),
+                row["kind"],
+                row["direction"],
+                int(row["segment"]),
+                float(row["timestamp"]),
+            )
+            for row in csv.DictReader(f)
+        ]
     
+def create_measurement_csv(csv_file: Path) -> None:
+    with open(csv_file, "w", newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["latency"])
+
+
 def append_measurement_to_csv(csv_file: Path, measurements: List[float]) -> None:
     with open(csv_file, "a", newline='') as f:
         writer = csv.writer(f)
-        writer.writerow(["latency"])
         for measurement in measurements:
             writer.writerow([measurement])
 
 
+def read_latencies_from_csv(csv_file: Path) -> List[float]:
+    # Prefer the values as reported by the Arduino if the file was corrected for clock drift
+    with open(csv_file, "r", newline='') as f:
+        reader = csv.DictReader(f)
+        column = "latency_raw" if "latency_raw" in reader.fieldnames else "latency"
+        return [float(row[column]) for row in reader if row[column]]
+
+
 def read_measurements_from_csv(csv_file: Path):
     with open(csv_file, "r") as f:
         reader = csv.reader(f)
@@ -297,10 +566,10 @@ def write_to_serial(serial: serial.Serial, data):
 
 def calibrate(serial: serial.Serial, threshold_offset: int):
     write_to_serial(serial, "cali")
-    _ = serial.readline().decode().rstrip('\r\n') 
+    _ = read_line(serial).rstrip('\r\n')
     # print(_)
     write_to_serial(serial, str(threshold_offset))
-    response = serial.readline().decode().rstrip('\r\n')
+    response = read_line(serial).rstrip('\r\n')
     #_ = serial.readline().decode().rstrip('\r\n')
     print("Done calibrating. Results:")     
     print(response + "\n")
@@ -329,11 +598,26 @@ def test_light(serial: serial.Serial, seconds: float):
 
     
 
+def read_line(serial: serial.Serial) -> str:
+    # A board that was just reset can send bytes that are not valid UTF-8
+    return serial.readline().decode(errors="ignore")
+
 def initMeasurement(serial: serial.Serial, numMeasurement):
     write_to_serial(serial, "meas")
-    _ = serial.readline().decode().rstrip('\r\n')
+    _ = read_line(serial).rstrip('\r\n')
     write_to_serial(serial, str(numMeasurement))
 
+def startMeasurement(serial: serial.Serial, numMeasurement):
+    initMeasurement(serial, numMeasurement)
+
+    # The firmware runs "meas N" as N + 1 measurements, the first one is read and discarded here.
+    # Its heartbeat and "wait" lines come before it and are skipped as well.
+    timeout = time.time() + 0.01
+    while True:
+        a = read_line(serial)
+        if a == "" or ("." in a and time.time() > timeout):
+            break
+
 def clear():
     os.system("clear") if os.name == "posix" else os.system("cls")
 
@@ -405,20 +689,25 @@ def menu(args):
             choice = input()
 
             if choice == "1":
-                serial = find_arduino_on_serial_port()
-                print("Warmup serial (3 sec)")
-                time.sleep(3)
+                serial = connect_arduino(args)
 
-                if args.calibrate:
-                    print("\nCalibrating")
-                    calibrate(serial, args.threshold_offset)
+                capture = read_measurements_from_arduino(serial, args)
+                capture.serial.close()
 
-                g2g_delays = read_measurements_from_arduino(serial, args)
-                serial.close()
+                change_points = capture.change_points
+                g2g_delays = correct_clock_drift(capture.measurements, capture.clock)
+                raw = capture.measurements if capture.clock.is_reliable() else None
 
                 stats = generate_stats(g2g_delays)
+                segments = None
+                if change_points:
+                    segments = segment_labels(len(g2g_delays), change_points)
+                    print_segment_stats(g2g_delays, segments)
                 try:
-                    write_measurements_to_csv(args.filename, g2g_delays) # , stats)
+                    write_measurements_to_csv(args.filename, g2g_delays, segments, raw) # , stats)
+                    write_metadata(metadata_file(args.filename), capture)
+                    if change_points:
+                        print(f"Saved change points to {change_points_file(args.filename)}")
                 except:
                     print(g2g_delays)
 
@@ -5,6 +5,10 @@ import numpy as np
 
 import argparse
 
+from G2GDelay.changepoint import detect_change_points, print_segment_stats, segment_labels
+from G2GDelay.density import binned_kde
+from G2GDelay.preprocess import OUTLIER_METHODS, preprocess
+
 
 def parse_arguments():
     argsparser = argparse.ArgumentParser(description="Analyze the latency from G2GDelay measurer. ")
@@ -13,7 +17,11 @@ def parse_arguments():
     argsparser.add_argument("--nbins", "-n", type=int, default=15, help="Number of bins for the histogram")
     argsparser.add_argument("--percentile", "-p", type=float, default=0.95, help="Percentile for the range plot")
     argsparser.add_argument("--remove_outliers", "-r", action="store_true", default=False, help="Remove outliers from the data")
-    argsparser.add_argument("--z-threshold", "-z", type=float, default=3, help="z-score threshold for outlier removal")
+    argsparser.add_argument("--outlier-method", "-m", choices=OUTLIER_METHODS, default="mad", help="Outlier test: median absolute deviation, interquartile range or plain z-score")
+    argsparser.add_argument("--z-threshold", "-z", type=float, default=3, help="(Robust) z-score threshold for outlier removal with the mad and zscore methods")
+    argsparser.add_argument("--iqr-factor", "-i", type=float, default=1.5, help="Samples further than this many IQRs outside the quartiles are outliers with the iqr method")
+    argsparser.add_argument("--segments", "-s", action="store_true", default=False, help="Detect level/variance changes if the file has no segment column")
+    argsparser.add_argument("--rolling-range", "-R", action="store_true", default=False, help="Also plot the moving median and the moving min/max band over the window")
 
     return argsparser.parse_args()
 
@@ -24,20 +32,77 @@ FILL_COLOR = sns.color_palette("flare")[0]
 PERC_COLOR = sns.color_palette("flare")[2]
 
 
-def plot_latency_statistics(args):
-    file_path = args.file
-    window_size = args.window
-    
-    data = pd.read_csv(file_path)
+def add_segments(data, args):
+    if 'segment' not in data.columns and args.segments:
+        change_points = detect_change_points(data['latency'].tolist())
+        data['segment'] = segment_labels(len(data), change_points)
+    return data
+
+
+def load_data(args):
+    data = add_segments(pd.read_csv(args.file), args)
+    return preprocess(
+        data,
+        window=args.window,
+        nbins=args.nbins,
+        remove_outliers=args.remove_outliers,
+        outlier_method=args.outlier_method,
+        z_threshold=args.z_threshold,
+        iqr_factor=args.iqr_factor,
+        rolling_range=args.rolling_range,
+    )
+
+
+MAX_PRINTED_OUTLIERS = 20
+
+
+def print_removed_outliers(prepared):
+    if len(prepared.removed) == 0:
+        return
+    # 1-based sample numbers, like the capture and the per-segment statistics
+    samples = ', '.join(str(i + 1) for i in prepared.removed[:MAX_PRINTED_OUTLIERS])
+    if len(prepared.removed) > MAX_PRINTED_OUTLIERS:
+        samples += f", ... ({len(prepared.removed) - MAX_PRINTED_OUTLIERS} more)"
+    print(f"Removed {len(prepared.removed)} outliers at samples: {samples}")
+
+
+def plot_histogram(ax, binned, vertical=True):
+    # Same look as sns.histplot(..., kde=True), drawn from the binned samples
+    widths = np.diff(binned.hist_edges)
+    bar_kws = dict(color=BASE_COLOR, alpha=0.75, edgecolor='black', linewidth=1.5, align='edge')
+    if vertical:
+        ax.bar(binned.hist_edges[:-1], binned.hist_counts, widths, **bar_kws)
+    else:
+        ax.barh(binned.hist_edges[:-1], binned.hist_counts, widths, **bar_kws)
+
+    kde = binned_kde(binned)
+    if kde is not None:
+        support, density = kde
+        if vertical:
+            ax.plot(support, density, color=BASE_COLOR)
+        else:
+            ax.plot(density, support, color=BASE_COLOR)
+
 
-    data['latency'] = data['latency'].rolling(window=window_size).mean().dropna()
-    data['Index'] = data.index
+def plot_rolling_range(ax, data):
+    if 'rolling_median' not in data.columns:
+        return
 
-    if args.remove_outliers:
-        z_scores = (data['latency'] - data['latency'].mean()) / data['latency'].std()
-        threshold = args.z_threshold
+    ax.fill_between(data['Index'], data['rolling_min'], data['rolling_max'], color=BASE_COLOR, alpha=0.15, label='Moving Min/Max')
+    ax.plot(data['Index'], data['rolling_median'], color=MEAN_COLOR, lw=1.5, linestyle='--', label='Moving Median')
 
-        data = data.loc[abs(z_scores) <= threshold]
+
+def plot_segment_boundaries(ax, data):
+    if 'segment' not in data.columns:
+        return
+
+    starts = data.groupby('segment')['Index'].min().iloc[1:]
+    for i, start in enumerate(starts):
+        ax.axvline(x=start, color='black', linestyle='--', linewidth=1, label='Change point' if i == 0 else None)
+
+
+def plot_latency_statistics(prepared, args):
+    data = prepared.data
 
     sns.set_theme(style='whitegrid')
     plt.figure(figsize=(14, 8))
@@ -45,20 +110,22 @@ def plot_latency_statistics(args):
     sns.lineplot(x='Index', y='latency', data=data, color=BASE_COLOR, lw=1.5, linestyle='-')
     sns.scatterplot(x='Index', y='latency', data=data, color=BASE_COLOR, s=20, alpha=0.7)
 
-    mean_latency = data['latency'].mean()
-    std_deviation = data['latency'].std()
-    min_latency = data['latency'].min()
-    max_latency = data['latency'].max()
-    median_latency = data['latency'].median()
+    mean_latency = prepared.mean
+    std_deviation = prepared.std
+    min_latency = prepared.min
+    max_latency = prepared.max
+    median_latency = prepared.median
 
     plt.axhline(y=mean_latency, color=MEAN_COLOR, linestyle='-', linewidth=4, label=f'Mean: {mean_latency:.2f}')
     plt.fill_between(data['Index'], mean_latency - std_deviation, mean_latency + std_deviation, color=PERC_COLOR, alpha=0.3, label='1 STD Range')
 
     percentile = args.percentile
-    lower_limit = data['latency'].quantile(1-percentile)
-    upper_limit = data['latency'].quantile(percentile)
+    lower_limit = prepared.quantile(1-percentile)
+    upper_limit = prepared.quantile(percentile)
 
     plt.fill_between(data['Index'], lower_limit, upper_limit, color=FILL_COLOR, alpha=0.3, label=f'{int(percentile*100)}% of Data')
+    plot_rolling_range(plt.gca(), data)
+    plot_segment_boundaries(plt.gca(), data)
 
     text_stats = f'Mean:   {mean_latency:.2f} ms\nMedian:   {median_latency:.2f} ms\nStandard Deviation:   {std_deviation:.2f} ms\nMax:   {max_latency:.2f} ms\nMin:   {min_latency:.2f} ms'
     plt.text(0.5, 0.95, text_stats, fontsize=12, horizontalalignment='right',transform=plt.gca().transAxes, bbox=dict(facecolor='white', edgecolor='black', alpha=0.5))
@@ -84,23 +151,18 @@ def plot_latency_statistics(args):
     plt.show()
 
 
-def plot_latency_histogram(args):
-
-    file_path = args.file
-    n_bins = args.nbins
-
-    data = pd.read_csv(file_path)
+def plot_latency_histogram(prepared, args):
 
     sns.set_theme(style='whitegrid')
     plt.figure(figsize=(14, 8))
 
-    sns.histplot(data, bins=n_bins, color=BASE_COLOR, kde=True, fill=True, edgecolor='black', linewidth=1.5)
+    plot_histogram(plt.gca(), prepared.binned)
 
-    mean_latency = data['latency'].mean()
-    std_deviation = data['latency'].std()
-    min_latency = data['latency'].min()
-    max_latency = data['latency'].max()
-    median_latency = data['latency'].median()
+    mean_latency = prepared.mean
+    std_deviation = prepared.std
+    min_latency = prepared.min
+    max_latency = prepared.max
+    median_latency = prepared.median
 
     text_stats = f'Mean: {mean_latency:.2f}\nMedian: {median_latency:.2f}\nStandard Deviation: {std_deviation:.2f}\nMax: {max_latency:.2f}\nMin: {min_latency:.2f}'
     plt.text(0.95, 0.5, text_stats, fontsize=12, horizontalalignment='right',transform=plt.gca().transAxes, bbox=dict(facecolor='white', edgecolor='black', alpha=0.5))
@@ -115,23 +177,14 @@ def plot_latency_histogram(args):
     plt.show()
 
 
-def plot_both(args):
-    
-    file_path = args.file
-    window_size = args.window
- 
-    data = pd.read_csv(file_path)
-
-    
-    data['latency'] = data['latency'].rolling(window=window_size).mean().dropna()
-    data['Index'] = data.index
-
-    if args.remove_outliers:
-        z_scores = (data['latency'] - data['latency'].mean()) / data['latency'].std()
-        threshold = args.z_threshold
+def plot_both(prepared, args):
+    create_analysis_figure(prepared, args)
+    # plt.savefig(f'{args.file[:-4]}_analysis.svg')
+    plt.show()
 
-        data = data[(np.abs(z_scores) < threshold)]
 
+def create_analysis_figure(prepared, args):
+    data = prepared.data
 
     sns.set_theme(style='whitegrid')
     fig, axs = plt.subplots(1, 2, figsize=(20, 8), width_ratios=[2, 1])
@@ -139,21 +192,23 @@ def plot_both(args):
     sns.lineplot(ax=axs[0], x='Index', y='latency', data=data, color=BASE_COLOR, lw=1.5, linestyle='-')
     sns.scatterplot(ax=axs[0], x='Index', y='latency', data=data, color=BASE_COLOR, s=20, alpha=0.7)
 
-    mean_latency = data['latency'].mean()
-    std_deviation = data['latency'].std()
-    min_latency = data['latency'].min()
-    max_latency = data['latency'].max()
-    median_latency = data['latency'].median()
+    mean_latency = prepared.mean
+    std_deviation = prepared.std
+    min_latency = prepared.min
+    max_latency = prepared.max
+    median_latency = prepared.median
 
 
     axs[0].axhline(y=mean_latency, color=MEAN_COLOR, linestyle='-', linewidth=4, label=f'Mean')
     axs[0].fill_between(data['Index'], mean_latency - std_deviation, mean_latency + std_deviation, color=PERC_COLOR, alpha=0.3, label='1 STD Range')
 
     percentile = args.percentile
-    lower_limit = data['latency'].quantile(1-percentile)
-    upper_limit = data['latency'].quantile(percentile)
+    lower_limit = prepared.quantile(1-percentile)
+    upper_limit = prepared.quantile(percentile)
 
     axs[0].fill_between(data['Index'], lower_limit, upper_limit, color=FILL_COLOR, alpha=0.3, label=f'{int(percentile*100)}% of Data')
+    plot_rolling_range(axs[0], data)
+    plot_segment_boundaries(axs[0], data)
 
     axs[0].text(0.95, mean_latency+std_deviation, f'{mean_latency + std_deviation:.2f}', fontsize=12,  horizontalalignment='right', bbox=dict(facecolor='white', edgecolor='black', alpha=0.5))
     axs[0].text(0.95, mean_latency-std_deviation, f'{mean_latency - std_deviation:.2f}', fontsize=12, horizontalalignment='right', bbox=dict(facecolor='white', edgecolor='black', alpha=0.5))
@@ -171,8 +226,7 @@ def plot_both(args):
 
     # Creating the histogram plot
 
-    n_bins = args.nbins
-    sns.histplot(data, ax=axs[1], y='latency', bins=n_bins, color=BASE_COLOR, kde=True, fill=True, edgecolor='black', linewidth=1.5)
+    plot_histogram(axs[1], prepared.binned, vertical=False)
 
     text_stats = f'Mean: {mean_latency:.2f}\nMedian: {median_latency:.2f}\nStandard Deviation: {std_deviation:.2f}\nMax: {max_latency:.2f}\nMin: {min_latency:.2f}'
     axs[1].text(0.95, 0.75, text_stats, fontsize=12, horizontalalignment='right',transform=plt.gca().transAxes, bbox=dict(facecolor='white', edgecolor='black', alpha=0.5))
@@ -184,17 +238,27 @@ def plot_both(args):
 
     sns.despine()
     plt.grid(False)
-    # plt.savefig(f'{file_path[:-4]}_analysis.svg')
-    plt.show()
+
+    return fig
 
 
 def main():
     import sys
 
     args = parse_arguments()
-    # plot_latency_statistics(args)
-    # plot_latency_histogram(args)
-    plot_both(args)
+    try:
+        prepared = load_data(args)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print_removed_outliers(prepared)
+    if 'segment' in prepared.data.columns:
+        data = prepared.data
+        print_segment_stats(data['latency'], data['segment'], data['Index'])
+
+    # plot_latency_statistics(prepared, args)
+    # plot_latency_histogram(prepared, args)
+    plot_both(prepared, args)
 
 
 
@@ -0,0 +1,254 @@
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from G2GDelay import G2GDelay as g2g
+from G2GDelay.analyze_results import create_analysis_figure, load_data
+from G2GDelay.simulator import SimulatedArduino, synthetic_latencies
+
+
+SCALES = (100, 10_000, 1_000_000, 10_000_000)
+MIN_MEASURE_TIME = 0.5  # fast stages are repeated until this much time is spent, so timer noise averages out
+MAX_RUNS = 1000
+
+# Stages that are too slow to run at every scale by default (use --all-scales to run them anyway)
+STAGE_LIMITS = {
+    "capture": 1_000_000,
+    "render": 1_000_000,
+}
+
+
+def parse_arguments():
+    argsparser = argparse.ArgumentParser(description="Benchmark the G2GDelay tool itself on synthetic data and a simulated "
+                                         "Arduino: capture loop, CSV persistence, statistics, analysis and rendering.")
+    argsparser.add_argument("--scales", type=lambda s: [int(n) for n in s.split(",")], default=list(SCALES), help="Comma separated sample counts. Default is 100,10000,1000000,10000000")
+    argsparser.add_argument("--stages", type=lambda s: s.split(","), default=list(STAGES), help=f"Comma separated stages to run. Default is all: {','.join(STAGES)}")
+    argsparser.add_argument("--repeat", type=int, default=3, help="Minimum timed runs per stage and scale, the fastest one is reported")
+    argsparser.add_argument("--all-scales", action="store_true", default=False, help="Also run capture and render above their default scale limits")
+    argsparser.add_argument("--save-baseline", type=Path, default=None, help="Save the results to this JSON file")
+    argsparser.add_argument("--compare", type=Path, default=None, help="Compare against a baseline JSON file, exit with 1 on regressions")
+    argsparser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown / memory growth relative to the baseline. Default is 0.25 (25%%)")
+
+    args = argsparser.parse_args()
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        argsparser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+    return args
+
+
+def capture_args(csv_file: Path, n: int) -> argparse.Namespace:
+    return argparse.Namespace(
+        filename=csv_file,
+        num_measurements=n,
+        quiet=True,
+        calibrate=False,
+        threshold_offset=10,
+        changepoint_threshold=10.0,
+        changepoint_warmup=50,
+        resume=False,
+    )
+
+
+def analysis_args(csv_file: Path) -> argparse.Namespace:
+    return argparse.Namespace(
+        file=str(csv_file),
+        window=10,
+        nbins=15,
+        percentile=0.95,
+        remove_outliers=True,
+        outlier_method="mad",
+        z_threshold=3,
+        iqr_factor=1.5,
+        segments=False,
+        rolling_range=False,
+    )
+
+
+def write_legacy_csv(csv_file: Path, latencies) -> None:
+    # Format read by read_measurements_from_csv: header, stats row, all samples in one row
+    with open(csv_file, "w", newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Samples", "Min", "Max", "Mean", "Median", "stdDev"])
+        writer.writerow([len(latencies), latencies.min(), latencies.max(), latencies.mean(), np.median(latencies), latencies.std()])
+        writer.writerow(latencies)
+
+
+# Every stage has a setup that is not timed, and returns the function to benchmark
+
+def stage_capture(latencies, workdir):
+    csv_file = workdir / "capture.csv"
+    return lambda: g2g.read_measurements_from_arduino(SimulatedArduino(latencies, timeout=0), capture_args(csv_file, len(latencies)))
+
+
+def stage_csv_write(latencies, workdir):
+    csv_file = workdir / "write.csv"
+    measurements = latencies.tolist()
+    segments = [0] * len(measurements)
+    return lambda: g2g.write_measurements_to_csv(csv_file, measurements, segments)
+
+
+def stage_csv_read(latencies, workdir):
+    csv_file = workdir / "read.csv"
+    g2g.write_measurements_to_csv(csv_file, latencies.tolist())
+    return lambda: g2g.read_latencies_from_csv(csv_file)
+
+
+def stage_csv_read_legacy(latencies, workdir):
+    csv_file = workdir / "read_legacy.csv"
+    write_legacy_csv(csv_file, latencies)
+    return lambda: g2g.read_measurements_from_csv(csv_file)
+
+
+def stage_generate_stats(latencies, workdir):
+    measurements = latencies.tolist()
+    return lambda: g2g.generate_stats(measurements)
+
+
+def stage_analysis(latencies, workdir):
+    csv_file = workdir / "analysis.csv"
+    g2g.write_measurements_to_csv(csv_file, latencies.tolist())
+    return lambda: load_data(analysis_args(csv_file))
+
+
+def stage_render(latencies, workdir):
+    csv_file = workdir / "render.csv"
+    g2g.write_measurements_to_csv(csv_file, latencies.tolist())
+    args = analysis_args(csv_file)
+    prepared = load_data(args)
+
+    def render():
+        fig = create_analysis_figure(prepared, args)
+        fig.savefig(io.BytesIO(), format="png")
+        plt.close(fig)
+
+    return render
+
+
+STAGES = {
+    "capture": stage_capture,
+    "csv_write": stage_csv_write,
+    "csv_read": stage_csv_read,
+    "csv_read_legacy": stage_csv_read_legacy,
+    "generate_stats": stage_generate_stats,
+    "analysis": stage_analysis,
+    "render": stage_render,
+}
+
+
+def measure(function, repeat: int):
+    """Fastest wall time of at least `repeat` runs, and the peak traced memory of one extra run."""
+    times = []
+    while len(times) < repeat or (sum(times) < MIN_MEASURE_TIME and len(times) < MAX_RUNS):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    # tracemalloc slows things down, so memory is measured in a separate run
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(times), peak
+
+
+def run_benchmarks(args) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        for n in args.scales:
+            latencies = synthetic_latencies(n)
+            for stage in args.stages:
+                if n > STAGE_LIMITS.get(stage, n) and not args.all_scales:
+                    continue
+                # The tool prints progress and stats, which would flood the benchmark output
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    function = STAGES[stage](latencies, workdir)
+                    seconds, peak = measure(function, args.repeat)
+                results[f"{stage}/{n}"] = {"stage": stage, "samples": n, "seconds": seconds, "peak_bytes": peak}
+                print_result(results[f"{stage}/{n}"])
+    return results
+
+
+def print_header():
+    print(f"{'stage':<16}{'samples':>10}{'time (s)':>12}{'samples/s':>14}{'us/sample':>12}{'peak (MB)':>12}")
+
+
+def print_result(result, baseline=None):
+    line = (
+        f"{result['stage']:<16}{result['samples']:>10}{result['seconds']:>12.4f}"
+        f"{result['samples'] / result['seconds']:>14.0f}{result['seconds'] / result['samples'] * 1e6:>12.2f}"
+        f"{result['peak_bytes'] / 1e6:>12.1f}"
+    )
+    if baseline is not None:
+        line += f"   time x{result['seconds'] / baseline['seconds']:.2f}  memory x{result['peak_bytes'] / max(baseline['peak_bytes'], 1):.2f}"
+    print(line)
+
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+    }
+
+
+def find_regressions(results: dict, baseline: dict, tolerance: float):
+    regressions = []
+    for key, result in results.items():
+        reference = baseline["results"].get(key)
+        if reference is None:
+            continue
+        if result["seconds"] > reference["seconds"] * (1 + tolerance):
+            regressions.append(f"{key}: time {reference['seconds']:.4f}s -> {result['seconds']:.4f}s")
+        if result["peak_bytes"] > reference["peak_bytes"] * (1 + tolerance):
+            regressions.append(f"{key}: peak memory {reference['peak_bytes'] / 1e6:.1f}MB -> {result['peak_bytes'] / 1e6:.1f}MB")
+    return regressions
+
+
+def main():
+    args = parse_arguments()
+    plt.switch_backend("Agg")
+
+    print_header()
+    results = run_benchmarks(args)
+
+    if args.save_baseline is not None:
+        args.save_baseline.write_text(json.dumps({"environment": environment(), "results": results}, indent=2))
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if args.compare is not None:
+        baseline = json.loads(args.compare.read_text())
+        if baseline.get("environment") != environment():
+            print(f"Warning: baseline was recorded in a different environment: {baseline.get('environment')}")
+
+        print(f"\nCompared to {args.compare}:")
+        print_header()
+        for key, result in results.items():
+            print_result(result, baseline["results"].get(key))
+
+        regressions = find_regressions(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressions (more than {args.tolerance:.0%} worse):")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import math
+
+
+MICROS_WRAP = 2 ** 32  # micros() is an unsigned long and wraps after ~71.6 minutes
+MAX_RATE_STDERR = 50e-6  # only correct when the rate is known better than 50 ppm
+
+
+class ClockDriftEstimator:
+    """
+    Online least-squares fit of the host monotonic clock against the Arduino's micros().
+
+        host_time = offset + rate * board_time
+
+    `rate` is how many host seconds pass per board second; multiplying a latency measured
+    with micros() by `rate` converts it to host time. Every heartbeat updates running
+    means and co-moments (Welford), so an update is O(1).
+
+    A board reset restarts micros(). `new_epoch` starts a new fit with its own offset
+    while the rate keeps being estimated from all epochs together (pooled slope).
+    """
+
+    def __init__(self):
+        self.heartbeats = 0
+        # Co-moments of the finished epochs
+        self._sxx = 0.0
+        self._sxy = 0.0
+        self._syy = 0.0
+        self._epochs = 0
+        self._start_epoch()
+
+    def _start_epoch(self) -> None:
+        self._n = 0
+        self._wraps = 0
+        self._last_micros = None
+        self._origin = None
+        self._mean_x = 0.0
+        self._mean_y = 0.0
+        self._cxx = 0.0
+        self._cxy = 0.0
+        self._cyy = 0.0
+
+    def new_epoch(self) -> None:
+        """The board clock restarted (reset or reconnect)."""
+        if self._n > 0:
+            self._sxx += self._cxx
+            self._sxy += self._cxy
+            self._syy += self._cyy
+            self._epochs += 1
+        self._start_epoch()
+
+    def update(self, board_micros: int, host_ns: int) -> None:
+        if self._last_micros is not None and board_micros < self._last_micros:
+            self._wraps += 1
+        self._last_micros = board_micros
+
+        # Seconds relative to the first heartbeat of the epoch, to keep the sums well conditioned
+        if self._origin is None:
+            self._origin = (board_micros, host_ns)
+        x = (board_micros + self._wraps * MICROS_WRAP - self._origin[0]) * 1e-6
+        y = (host_ns - self._origin[1]) * 1e-9
+
+        self.heartbeats += 1
+        self._n += 1
+        dx = x - self._mean_x
+        dy = y - self._mean_y
+        self._mean_x += dx / self._n
+        self._mean_y += dy / self._n
+        self._cxx += dx * (x - self._mean_x)
+        self._cxy += dx * (y - self._mean_y)
+        self._cyy += dy * (y - self._mean_y)
+
+    @property
+    def _totals(self):
+        return self._sxx + self._cxx, self._sxy + self._cxy, self._syy + self._cyy
+
+    @property
+    def rate(self) -> float:
+        sxx, sxy, _ = self._totals
+        return sxy / sxx if sxx > 0 else 1.0
+
+    @property
+    def drift_ppm(self) -> float:
+        """How much faster the board clock runs than the host clock, in ppm."""
+        return (1 / self.rate - 1) * 1e6
+
+    @property
+    def offset(self) -> float:
+        """Host time (s) at board time 0 of the current epoch, relative to the first heartbeat."""
+        return self._mean_y - self.rate * self._mean_x
+
+    @property
+    def residual_std(self) -> float:
+        """Scatter of the heartbeat arrival times around the fit, in seconds."""
+        sxx, sxy, syy = self._totals
+        # One offset per epoch and one shared rate
+        dof = self.heartbeats - (self._epochs + (self._n > 0) + 1)
+        if sxx <= 0 or dof <= 0:
+            return math.nan
+        return math.sqrt(max(syy - sxy * sxy / sxx, 0.0) / dof)
+
+    @property
+    def rate_stderr(self) -> float:
+        sxx, _, _ = self._totals
+        residual_std = self.residual_std
+        if sxx <= 0 or math.isnan(residual_std):
+            return math.inf
+        return residual_std / math.sqrt(sxx)
+
+    def is_reliable(self) -> bool:
+        return self.rate_stderr < MAX_RATE_STDERR
+
+    def correct(self, latency: float) -> float:
+        """Latency in host time, or unchanged while the rate is not known well enough."""
+        return latency * self.rate if self.is_reliable() else latency
+
+    def to_dict(self) -> dict:
+        sxx, sxy, syy = self._totals
+        return {
+            "rate": self.rate,
+            "drift_ppm": self.drift_ppm,
+            "rate_stderr_ppm": _finite(self.rate_stderr * 1e6),
+            "offset_s": self.offset,
+            "residual_us": _finite(self.residual_std * 1e6),
+            "heartbeats": self.heartbeats,
+            "corrected": self.is_reliable(),
+            "fit": {"sxx": sxx, "sxy": sxy, "syy": syy, "epochs": self._epochs + (self._n > 0)},
+        }
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "ClockDriftEstimator":
+        """Continue the fit of a previous session (see to_dict). Starts a new epoch."""
+        estimator = cls()
+        fit = values["fit"]
+        estimator.heartbeats = values["heartbeats"]
+        estimator._sxx, estimator._sxy, estimator._syy = fit["sxx"], fit["sxy"], fit["syy"]
+        estimator._epochs = fit["epochs"]
+        return estimator
+
+
+def _finite(value: float):
+    # JSON has no NaN/inf
+    return value if math.isfinite(value) else None
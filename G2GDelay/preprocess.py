@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+
+from G2GDelay.density import BinnedSamples, bin_samples
+
+
+OUTLIER_METHODS = ("mad", "iqr", "zscore")
+MAD_SCALE = 0.6745  # makes the MAD a consistent estimator of the std for normal data
+MEAN_AD_SCALE = 1.2533  # same for the mean absolute deviation (sqrt(pi / 2))
+
+
+@dataclass
+class Preprocessed:
+    data: pd.DataFrame    # Index, raw, latency (moving average)[, rolling_median, rolling_min, rolling_max][, segment]
+    removed: np.ndarray   # sample indices removed as outliers
+    binned: BinnedSamples
+    mean: float
+    median: float
+    std: float
+    min: float
+    max: float
+
+    def quantile(self, q: float) -> float:
+        # Exact, with linear interpolation between order statistics like pandas. The binned
+        # grid is too coarse for this where the samples are sparse (the tails).
+        return float(np.quantile(self.data['latency'].to_numpy(), q))
+
+
+def outlier_mask(values: np.ndarray, method: str = "mad", z_threshold: float = 3.0, iqr_factor: float = 1.5) -> np.ndarray:
+    """
+    True for the samples that are outliers.
+
+    mad:    |0.6745 * (x - median) / MAD| > z_threshold
+    iqr:    outside [Q1 - iqr_factor * IQR, Q3 + iqr_factor * IQR]
+    zscore: |x - mean| / std > z_threshold (the outliers inflate the std, kept for comparison)
+    """
+    if method == "mad":
+        median = np.median(values)
+        deviation = np.abs(values - median)
+        mad = np.median(deviation)
+        if mad == 0:
+            # More than half of the samples are identical, fall back to the mean absolute deviation:
+            # the score becomes (x - median) / (1.2533 * meanAD)
+            mad = MAD_SCALE * MEAN_AD_SCALE * np.mean(deviation)
+        if mad == 0:
+            return np.zeros(len(values), dtype=bool)
+        return MAD_SCALE * deviation / mad > z_threshold
+
+    if method == "iqr":
+        q1, q3 = np.percentile(values, [25, 75])
+        iqr = q3 - q1
+        return (values < q1 - iqr_factor * iqr) | (values > q3 + iqr_factor * iqr)
+
+    if method == "zscore":
+        std = np.std(values, ddof=1)
+        if std == 0:
+            return np.zeros(len(values), dtype=bool)
+        return np.abs(values - np.mean(values)) / std > z_threshold
+
+    raise ValueError(f"Unknown outlier method '{method}', expected one of {OUTLIER_METHODS}")
+
+
+def rolling_statistics(latency: pd.Series, window: int, rolling_range: bool = False) -> pd.DataFrame:
+    """
+    Moving mean over the window (vectorized). With `rolling_range`, also the moving median,
+    min and max over the same window; the rolling median is by far the slowest part.
+    """
+    columns = ('latency', 'rolling_median', 'rolling_min', 'rolling_max') if rolling_range else ('latency',)
+    if window == 1:
+        # Every statistic of a single sample is the sample itself
+        return pd.DataFrame({column: latency for column in columns})
+
+    rolling = latency.rolling(window=window)
+    statistics = pd.DataFrame({'latency': rolling.mean()})
+    if rolling_range:
+        statistics['rolling_median'] = rolling.median()
+        statistics['rolling_min'] = rolling.min()
+        statistics['rolling_max'] = rolling.max()
+    return statistics
+
+
+def preprocess(data: pd.DataFrame, window: int = 1, nbins: int = 15, remove_outliers: bool = False,
+               outlier_method: str = "mad", z_threshold: float = 3.0, iqr_factor: float = 1.5,
+               rolling_range: bool = False) -> Preprocessed:
+    """
+    Outlier removal on the raw samples, then moving window statistics over the remaining ones.
+    The first window - 1 samples have no full window and are dropped. 'Index' keeps the
+    original sample number, so gaps show where samples were removed.
+    """
+    data = data.dropna(subset=['latency']).reset_index(drop=True)
+    data = data.rename(columns={'latency': 'raw'})
+    data.insert(0, 'Index', data.index)
+
+    removed = np.array([], dtype=int)
+    if remove_outliers:
+        mask = outlier_mask(data['raw'].to_numpy(), outlier_method, z_threshold, iqr_factor)
+        removed = data['Index'].to_numpy()[mask]
+        data = data[~mask].reset_index(drop=True)
+
+    if window < 1:
+        raise ValueError(f"The window must be at least 1 sample, got {window}")
+    if window > len(data):
+        raise ValueError(
+            f"The window of {window} samples is larger than the {len(data)} samples"
+            f"{' left after outlier removal' if remove_outliers else ''}"
+        )
+
+    data = data.join(rolling_statistics(data['raw'], window, rolling_range))
+    data = data.iloc[window - 1:].reset_index(drop=True)
+
+    latency = data['latency']
+    return Preprocessed(
+        data=data,
+        removed=removed,
+        binned=bin_samples(latency, nbins),
+        mean=latency.mean(),
+        median=latency.median(),
+        std=latency.std(),
+        min=latency.min(),
+        max=latency.max(),
+    )
@@ -0,0 +1,221 @@
+import argparse
+import hashlib
+import html
+import json
+import sys
+from pathlib import Path
+
+import matplotlib.pyplot as plt
+
+from G2GDelay import analyze_results, changepoint, density, preprocess
+from G2GDelay.analyze_results import create_analysis_figure, load_data
+from G2GDelay.preprocess import OUTLIER_METHODS
+
+
+# Modules whose code determines the cached statistics and figures
+ANALYSIS_MODULES = (analyze_results, changepoint, density, preprocess, sys.modules[__name__])
+
+
+def analysis_code_hash() -> str:
+    """Changes whenever the analysis code changes, so cached artifacts are rebuilt."""
+    digest = hashlib.sha256()
+    for module in ANALYSIS_MODULES:
+        digest.update(Path(module.__file__).read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def parse_arguments():
+    argsparser = argparse.ArgumentParser(description="Build an HTML report for a directory of G2GDelay measurements. "
+                                         "Figures and statistics are cached by a hash of the data and the analysis "
+                                         "parameters, so only new or changed runs are analyzed again.")
+    argsparser.add_argument("directory", type=Path, help="Directory with the CSV files of the runs")
+    argsparser.add_argument("--output", "-o", type=Path, default=None, help="Output directory for the report (default: <directory>/report)")
+    argsparser.add_argument("--window", "-w", type=int, default=1, help="Window size for the moving average")
+    argsparser.add_argument("--nbins", "-n", type=int, default=15, help="Number of bins for the histogram")
+    argsparser.add_argument("--percentile", "-p", type=float, default=0.95, help="Percentile for the range plot")
+    argsparser.add_argument("--remove_outliers", "-r", action="store_true", default=False, help="Remove outliers from the data")
+    argsparser.add_argument("--outlier-method", "-m", choices=OUTLIER_METHODS, default="mad", help="Outlier test: median absolute deviation, interquartile range or plain z-score")
+    argsparser.add_argument("--z-threshold", "-z", type=float, default=3, help="(Robust) z-score threshold for outlier removal with the mad and zscore methods")
+    argsparser.add_argument("--iqr-factor", "-i", type=float, default=1.5, help="Samples further than this many IQRs outside the quartiles are outliers with the iqr method")
+    argsparser.add_argument("--segments", "-s", action="store_true", default=False, help="Detect level/variance changes if a file has no segment column")
+    argsparser.add_argument("--rolling-range", "-R", action="store_true", default=False, help="Also plot the moving median and the moving min/max band over the window")
+
+    args = argsparser.parse_args()
+    if args.output is None:
+        args.output = args.directory / "report"
+    return args
+
+
+def find_runs(directory: Path):
+    return sorted(
+        path for path in directory.glob("*.csv")
+        if not path.stem.endswith("_changepoints")
+    )
+
+
+def analysis_parameters(args) -> dict:
+    return {
+        "code": analysis_code_hash(),
+        "window": args.window,
+        "nbins": args.nbins,
+        "percentile": args.percentile,
+        "remove_outliers": args.remove_outliers,
+        "outlier_method": args.outlier_method,
+        "z_threshold": args.z_threshold,
+        "iqr_factor": args.iqr_factor,
+        "segments": args.segments,
+        "rolling_range": args.rolling_range,
+    }
+
+
+def run_hash(csv_file: Path, parameters: dict) -> str:
+    digest = hashlib.sha256()
+    digest.update(csv_file.read_bytes())
+    digest.update(json.dumps(parameters, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+
+def run_args(csv_file: Path, args) -> argparse.Namespace:
+    return argparse.Namespace(
+        file=str(csv_file),
+        window=args.window,
+        nbins=args.nbins,
+        percentile=args.percentile,
+        remove_outliers=args.remove_outliers,
+        outlier_method=args.outlier_method,
+        z_threshold=args.z_threshold,
+        iqr_factor=args.iqr_factor,
+        segments=args.segments,
+        rolling_range=args.rolling_range,
+    )
+
+
+def compute_run_stats(prepared, args) -> dict:
+    data = prepared.data
+    return {
+        "samples": int(len(data)),
+        "mean": float(prepared.mean),
+        "median": float(prepared.median),
+        "std": float(prepared.std),
+        "min": float(prepared.min),
+        "max": float(prepared.max),
+        "lower": prepared.quantile(1 - args.percentile),
+        "upper": prepared.quantile(args.percentile),
+        "segments": int(data['segment'].nunique()) if 'segment' in data.columns else 1,
+        "removed": int(len(prepared.removed)),
+    }
+
+
+def build_run(csv_file: Path, args, cache_dir: Path, key: str) -> dict:
+    """Analyze one run, or load the cached result if this data has been analyzed with the same parameters."""
+    stats_file = cache_dir / f"{csv_file.stem}-{key}.json"
+    figure_file = cache_dir / f"{csv_file.stem}-{key}.svg"
+
+    if stats_file.exists() and figure_file.exists():
+        stats = json.loads(stats_file.read_text())
+        stats["cached"] = True
+        return stats
+
+    analysis_args = run_args(csv_file, args)
+    prepared = load_data(analysis_args)
+
+    fig = create_analysis_figure(prepared, analysis_args)
+    fig.savefig(figure_file)
+    plt.close(fig)
+
+    stats = compute_run_stats(prepared, args)
+    stats["run"] = csv_file.stem
+    stats["figure"] = f"{cache_dir.name}/{figure_file.name}"
+    stats_file.write_text(json.dumps(stats, indent=2))
+
+    stats["cached"] = False
+    return stats
+
+
+def render_html(runs, args) -> str:
+    p_low = f"P{round((1 - args.percentile) * 100)}"
+    p_high = f"P{round(args.percentile * 100)}"
+    header = ["Run", "Samples", "Mean", "Median", "Std", "Min", "Max", p_low, p_high, "Segments", "Removed"]
+
+    rows = []
+    for run in runs:
+        name = html.escape(run["run"])
+        cells = [f'<a href="#{name}">{name}</a>', str(run["samples"])]
+        cells += [f'{run[key]:.2f}' for key in ("mean", "median", "std", "min", "max", "lower", "upper")]
+        cells.append(str(run["segments"]))
+        cells.append(str(run["removed"]))
+        rows.append("<tr>" + "".join(f"<td>{cell}</td>" for cell in cells) + "</tr>")
+
+    figures = [
+        f'<h2 id="{html.escape(run["run"])}">{html.escape(run["run"])}</h2>\n'
+        f'<img src="{html.escape(run["figure"])}" alt="{html.escape(run["run"])}">'
+        for run in runs
+    ]
+
+    parameters = ", ".join(f"{key}={value}" for key, value in analysis_parameters(args).items() if key != "code")
+
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Glass-to-glass latency report</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; }}
+th, td {{ border: 1px solid #999; padding: 4px 8px; text-align: right; }}
+th:first-child, td:first-child {{ text-align: left; }}
+img {{ max-width: 100%; }}
+</style>
+</head>
+<body>
+<h1>Glass-to-glass latency report</h1>
+<p>{html.escape(str(args.directory))} ({html.escape(parameters)}). All latencies in ms.</p>
+<table>
+<tr>{"".join(f"<th>{column}</th>" for column in header)}</tr>
+{chr(10).join(rows)}
+</table>
+{chr(10).join(figures)}
+</body>
+</html>
+"""
+
+
+def build_report(args) -> Path:
+    cache_dir = args.output / "cache"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    parameters = analysis_parameters(args)
+
+    runs = []
+    used_files = set()
+    for csv_file in find_runs(args.directory):
+        key = run_hash(csv_file, parameters)
+        try:
+            run = build_run(csv_file, args, cache_dir, key)
+        except (KeyError, ValueError) as e:
+            print(f"Skipped: {csv_file.name} ({str(e).strip()})")
+            continue
+        print(f"{'Cached' if run['cached'] else 'Analyzed'}: {csv_file.name}")
+        runs.append(run)
+        used_files.update({f"{csv_file.stem}-{key}.json", f"{csv_file.stem}-{key}.svg"})
+
+    # Drop artifacts of runs that changed or were removed
+    for stale in cache_dir.iterdir():
+        if stale.name not in used_files:
+            stale.unlink()
+
+    index = args.output / "index.html"
+    index.write_text(render_html(runs, args), encoding="utf-8")
+
+    rebuilt = sum(not run["cached"] for run in runs)
+    print(f"Report saved to {index} ({rebuilt} analyzed, {len(runs) - rebuilt} from cache)")
+    return index
+
+
+def main():
+    args = parse_arguments()
+    plt.switch_backend("Agg")
+    build_report(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import time
+from collections import deque
+
+import numpy as np
+
+from G2GDelay.clock import MICROS_WRAP
+
+
+class SimulatedArduino:
+    """
+    Stand-in for the serial connection to the latency_measurement firmware.
+
+    Understands the commands sent by G2GDelay (cali, meas, light_on, light_off, test_light,
+    stop) and answers like the firmware does, with `sample_interval` seconds instead of
+    the random 1-2 s pause between measurements. Latencies are drawn from `latencies`
+    (cycled) or from a synthetic distribution. Like the firmware, "meas N" produces N + 1
+    measurements, each preceded by a "hb <micros>" heartbeat.
+
+    The board clock runs `clock_skew_ppm` faster than the host clock: micros() and the
+    reported latencies are scaled by (1 + skew). micros() starts at `micros_start` and
+    wraps at 2^32 like an unsigned long.
+    """
+
+    def __init__(self, latencies=None, seed: int = 0, timeout: float = 10, first_sample_delay: float = 0.02,
+                 sample_interval: float = 0.0, clock_skew_ppm: float = 0.0, micros_start: int = 0):
+        self.rng = np.random.default_rng(seed)
+        self.latencies = None if latencies is None else np.asarray(latencies, dtype=float)
+        self.timeout = timeout
+        self.first_sample_delay = first_sample_delay
+        self.sample_interval = sample_interval
+        self.clock_skew = clock_skew_ppm * 1e-6
+        self.micros_start = micros_start
+        self.is_open = True
+        self._start_ns = time.monotonic_ns()
+
+        self._lines = deque()
+        self._pending = None  # command waiting for its numeric argument
+        self._remaining = 0
+        self._produced = 0
+        self._first_sample = False
+        self._synthetic = False
+
+    def _next_latency(self) -> float:
+        if self.latencies is None or self._produced == len(self.latencies):
+            if self.latencies is None or self._synthetic:
+                # Generated in blocks to keep the per-sample cost of the simulator low
+                self.latencies = synthetic_latencies(4096, self.rng)
+                self._synthetic = True
+            self._produced = 0
+        value = self.latencies[self._produced]
+        self._produced += 1
+        return value
+
+    def micros(self) -> int:
+        elapsed_us = (time.monotonic_ns() - self._start_ns) / 1000
+        return int(self.micros_start + elapsed_us * (1 + self.clock_skew)) % MICROS_WRAP
+
+    def write(self, data: bytes) -> int:
+        command = data.decode().strip()
+
+        if self._pending == "cali":
+            self._lines.append("Min: 12 Max: 640 Threshold: %d" % (12 + int(command)))
+            self._pending = None
+        elif self._pending == "meas":
+            self._remaining = int(command) + 1
+            self._first_sample = True
+            self._pending = None
+        elif command in ("cali", "meas"):
+            self._lines.append("")
+            self._pending = command
+        elif command in ("light_on", "test_light"):
+            self._lines.append("")
+        elif command == "stop":
+            self._remaining = 0
+
+        return len(data)
+
+    def readline(self) -> bytes:
+        if self._lines:
+            return (self._lines.popleft() + "\r\n").encode()
+
+        if self._remaining > 0:
+            if self._first_sample:
+                # The firmware takes a moment before the first measurement is ready
+                time.sleep(self.first_sample_delay)
+                self._first_sample = False
+            elif self.sample_interval > 0:
+                time.sleep(self.sample_interval)
+            self._remaining -= 1
+            latency = self._next_latency() * (1 + self.clock_skew)
+            self._lines.append("%.2f" % latency)
+            return ("hb %d\r\n" % self.micros()).encode()
+
+        # Nothing to send: behave like a read timeout
+        time.sleep(self.timeout)
+        return b""
+
+    def close(self) -> None:
+        self.is_open = False
+
+
+def synthetic_latencies(n: int, rng=None) -> np.ndarray:
+    """Latencies shaped like the recorded runs: ~70 ms with frame jitter and occasional spikes."""
+    rng = np.random.default_rng(0) if rng is None else rng
+    latencies = rng.normal(70, 4, n) + rng.exponential(2, n)
+    spikes = rng.random(n) < 0.005
+    latencies[spikes] += rng.uniform(15, 40, spikes.sum())
+    return np.round(latencies, 2)
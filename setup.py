@@ -15,6 +15,8 @@ setup(
         'console_scripts': [
             'G2GDelay=G2GDelay.G2GDelay:main',
             'G2GDelay-analyze=G2GDelay.analyze_results:main',
+            'G2GDelay-report=G2GDelay.report:main',
+            'G2GDelay-benchmark=G2GDelay.benchmark:main',
         ],
     },
     author='Martin Simengård',
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from G2GDelay.changepoint import CusumDetector, detect_change_points, segment_labels
+from G2GDelay.simulator import synthetic_latencies
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_no_alarms_on_stationary_data(seed):
+    rng = np.random.default_rng(seed)
+    assert detect_change_points(list(rng.normal(70, 4, 2000))) == []
+    assert detect_change_points(list(synthetic_latencies(2000, rng))) == []
+
+
+@pytest.mark.parametrize("generate", [
+    lambda rng: rng.normal(70, 4, 5000),
+    lambda rng: synthetic_latencies(5000, rng),
+], ids=["normal", "skewed"])
+def test_false_alarm_rate(generate):
+    # The documented rate: at most 0.05 false alarms per 1000 samples
+    alarms = sum(len(detect_change_points(list(generate(np.random.default_rng(seed))))) for seed in range(20))
+    assert alarms <= 5
+
+
+def test_no_alarms_on_constant_data():
+    assert detect_change_points([70.0] * 2000) == []
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_level_shift_detected_quickly(seed):
+    values = np.random.default_rng(100 + seed).normal(70, 4, 600)
+    values[300:] += 10  # 2.5 sigma
+
+    changes = detect_change_points(list(values))
+
+    assert len(changes) == 1
+    change = changes[0]
+    assert (change.kind, change.direction, change.segment) == ("level", "up", 1)
+    assert 300 <= change.detected_at <= 315
+    assert abs(change.sample - 300) <= 5
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_variance_increase_detected(seed):
+    values = np.random.default_rng(200 + seed).normal(70, 4, 600)
+    values[300:] = 70 + (values[300:] - 70) * 2
+
+    changes = detect_change_points(list(values))
+
+    assert changes
+    assert 300 <= changes[0].detected_at <= 360
+
+
+def test_segment_labels():
+    detector = CusumDetector()
+    for value in np.random.default_rng(0).normal(70, 4, 100):
+        detector.update(value)
+    gap = detector.mark_gap()
+    for value in np.random.default_rng(1).normal(70, 4, 50):
+        detector.update(value)
+
+    assert (gap.sample, gap.kind, gap.segment) == (100, "gap", 1)
+    assert segment_labels(150, detector.change_points) == [0] * 100 + [1] * 50
+
+
+def test_restore_continues_indexing_after_gap():
+    values = np.random.default_rng(2).normal(70, 4, 400)
+    values[150:] += 10
+
+    detector = CusumDetector()
+    for value in values[:250]:
+        detector.update(value)
+    saved = list(detector.change_points)
+    assert [change.segment for change in saved] == [1]
+
+    # A new session continues the same run after 250 samples
+    resumed = CusumDetector()
+    resumed.restore(250, saved)
+    gap = resumed.mark_gap()
+    assert (gap.sample, gap.segment) == (250, 2)
+    for value in values[250:]:
+        assert resumed.update(value) is None
+    assert resumed.n == 400
+
+    labels = segment_labels(400, resumed.change_points)
+    assert labels[:saved[0].sample] == [0] * saved[0].sample
+    assert labels[saved[0].sample:250] == [1] * (250 - saved[0].sample)
+    assert labels[250:] == [2] * 150
@@ -0,0 +1,89 @@
+import argparse
+
+import pytest
+from serial import SerialException
+
+from G2GDelay import G2GDelay as g2g
+from G2GDelay.clock import MICROS_WRAP, ClockDriftEstimator
+from G2GDelay.simulator import SimulatedArduino, synthetic_latencies
+
+
+SAMPLE_INTERVAL = 0.02  # the host is idle between measurements, like with the real 1-2 s pause
+
+
+class DroppingArduino(SimulatedArduino):
+    """Raises a serial error once after `drop_after` lines, like an unplugged cable."""
+
+    def __init__(self, *args, drop_after: int, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.drop_after = drop_after
+        self.lines = 0
+
+    def readline(self) -> bytes:
+        self.lines += 1
+        if self.lines == self.drop_after:
+            raise SerialException("device disconnected")
+        return super().readline()
+
+
+def capture_args(csv_file, n):
+    return argparse.Namespace(
+        filename=csv_file,
+        num_measurements=n,
+        quiet=True,
+        calibrate=False,
+        threshold_offset=10,
+        changepoint_threshold=10.0,
+        changepoint_warmup=50,
+        resume=False,
+    )
+
+
+@pytest.mark.parametrize("skew_ppm", [3000, -3000])
+def test_capture_corrects_clock_skew(tmp_path, monkeypatch, skew_ppm):
+    latencies = synthetic_latencies(200)
+    # micros() wraps about a second into the run, then the board resets and reconnects
+    board = DroppingArduino(latencies, timeout=0, sample_interval=SAMPLE_INTERVAL, clock_skew_ppm=skew_ppm,
+                            micros_start=MICROS_WRAP - 1_000_000, drop_after=150)
+    reset_board = SimulatedArduino(latencies, timeout=0, sample_interval=SAMPLE_INTERVAL, clock_skew_ppm=skew_ppm)
+    monkeypatch.setattr(g2g, "connect_arduino", lambda args: reset_board)
+
+    capture = g2g.read_measurements_from_arduino(board, capture_args(tmp_path / "run.csv", 120))
+
+    assert len(capture.measurements) == 120
+    assert [change.kind for change in capture.change_points] == ["gap"]
+    assert capture.clock.is_reliable()
+    assert capture.clock.drift_ppm == pytest.approx(skew_ppm, abs=10)
+
+    corrected = g2g.correct_clock_drift(capture.measurements, capture.clock)
+    for measured, value in zip(capture.measurements, corrected):
+        assert value == pytest.approx(measured / (1 + skew_ppm * 1e-6), abs=0.005)
+
+
+def test_micros_wrap_and_new_epoch():
+    # Board clock 1000 ppm fast, reset halfway through
+    clock = ClockDriftEstimator()
+    for epoch_start in (MICROS_WRAP - 5_000_000, 0):
+        clock.new_epoch()
+        for second in range(10):
+            board_micros = int(epoch_start + second * 1e6 * 1.001) % MICROS_WRAP
+            clock.update(board_micros, second * 1_000_000_000 + 1_000_000_000 * 100 * (epoch_start == 0))
+
+    assert clock.drift_ppm == pytest.approx(1000, abs=0.5)
+    assert clock.is_reliable()
+
+
+def test_not_reliable_without_heartbeats():
+    clock = ClockDriftEstimator()
+    assert not clock.is_reliable()
+    assert clock.correct(70.0) == 70.0
+
+
+def test_continues_fit_from_dict():
+    clock = ClockDriftEstimator()
+    for second in range(10):
+        clock.update(int(second * 1e6 * 0.999), second * 1_000_000_000)
+
+    restored = ClockDriftEstimator.from_dict(clock.to_dict())
+    assert restored.rate == pytest.approx(clock.rate)
+    assert restored.heartbeats == clock.heartbeats
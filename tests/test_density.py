@@ -0,0 +1,33 @@
+from pathlib import Path
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+import seaborn as sns
+
+from G2GDelay.density import bin_samples, binned_kde
+
+
+RESULTS = Path(__file__).resolve().parent.parent / "Results"
+RUNS = ["results_INFER_1080p_PIPE_DLA.csv", "results_INFER_720_PIPE.csv", "results_infer_1080p_v8l_fp16.csv"]
+
+
+@pytest.mark.parametrize("run", RUNS)
+def test_kde_matches_seaborn(run):
+    latency = pd.read_csv(RESULTS / run)['latency'].dropna()
+    nbins = 15
+
+    ax = sns.histplot(latency, bins=nbins, kde=True)
+    expected_x, expected_y = ax.lines[0].get_data()
+    plt.close(ax.figure)
+
+    support, density = binned_kde(bin_samples(latency, nbins))
+    np.testing.assert_allclose(support, expected_x, rtol=1e-9)
+    np.testing.assert_allclose(density, expected_y, rtol=1e-4)
+
+
+def test_kde_of_constant_samples_is_none():
+    assert binned_kde(bin_samples([70.0] * 10)) is None
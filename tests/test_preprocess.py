@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from G2GDelay.preprocess import outlier_mask, preprocess
+
+
+@pytest.mark.parametrize("values", [
+    [10, 20, 30, 40, 50],
+    [70.5, 71.2, 69.8, 120.0, 70.1, 70.3, 68.9],
+    list(np.random.default_rng(0).normal(70, 4, 37).round(2)),
+])
+@pytest.mark.parametrize("q", [0.0, 0.05, 0.1, 0.5, 0.9, 0.95, 1.0])
+def test_quantile_matches_pandas(values, q):
+    prepared = preprocess(pd.DataFrame({'latency': values}))
+    assert prepared.quantile(q) == pytest.approx(pd.Series(values, dtype=float).quantile(q))
+
+
+SPIKES = [50, 120, 121, 400]
+
+
+def spiky_series(n=500):
+    values = np.random.default_rng(1).normal(70, 4, n)
+    values[SPIKES] += [40, 60, -45, 80]
+    return values
+
+
+@pytest.mark.parametrize("method", ["mad", "iqr", "zscore"])
+def test_outlier_mask_finds_spikes(method):
+    mask = outlier_mask(spiky_series(), method)
+    assert set(SPIKES) <= set(np.flatnonzero(mask))
+    # Only a few of the 500 normal samples are flagged
+    assert mask.sum() <= len(SPIKES) + 10
+
+
+def test_mad_is_not_masked_by_the_spikes_like_zscore():
+    values = np.full(20, 70.0) + np.arange(20) * 0.1
+    values[[3, 10, 15]] = [200, 210, 205]
+    # The spikes inflate the std so much that the plain z-score misses them
+    assert not outlier_mask(values, "zscore").any()
+    assert list(np.flatnonzero(outlier_mask(values, "mad"))) == [3, 10, 15]
+
+
+def test_mad_falls_back_to_mean_absolute_deviation():
+    values = np.array([70.0] * 60 + [71, 69, 75, 65, 90, 100])
+    deviation = np.abs(values - 70)
+    expected = deviation / (1.2533 * deviation.mean()) > 3
+    assert (outlier_mask(values, "mad") == expected).all()
+
+
+def test_constant_samples_have_no_outliers():
+    for method in ("mad", "iqr", "zscore"):
+        assert not outlier_mask(np.full(10, 70.0), method).any()
+
+
+def test_unknown_outlier_method():
+    with pytest.raises(ValueError, match="Unknown outlier method"):
+        outlier_mask(np.arange(10.0), "median")
+
+
+def test_preprocess_window_with_outlier_removal():
+    values = spiky_series()
+    window = 5
+    prepared = preprocess(pd.DataFrame({'latency': values}), window=window, remove_outliers=True)
+
+    assert set(SPIKES) <= set(prepared.removed)
+    kept = np.delete(np.arange(len(values)), prepared.removed)
+    # The first window - 1 remaining samples have no full window and are dropped,
+    # Index keeps the original sample numbers around the removed spikes
+    assert list(prepared.data['Index']) == list(kept[window - 1:])
+    assert (prepared.data['raw'] == values[prepared.data['Index']]).all()
+    expected_mean = pd.Series(values[kept]).rolling(window).mean().iloc[window - 1:]
+    np.testing.assert_allclose(prepared.data['latency'], expected_mean)
+    assert 'rolling_median' not in prepared.data.columns
+    assert prepared.binned.n == len(prepared.data)
+
+
+def test_preprocess_rolling_range():
+    values = spiky_series()
+    data = preprocess(pd.DataFrame({'latency': values}), window=3, rolling_range=True).data
+    assert data['rolling_min'].iloc[0] == values[:3].min()
+    assert data['rolling_max'].iloc[0] == values[:3].max()
+    assert data['rolling_median'].iloc[0] == np.median(values[:3])
+
+
+@pytest.mark.parametrize("window", [0, 30, 40])
+def test_window_larger_than_samples(window):
+    values = [70.0 + i % 7 for i in range(30)]
+    values[5] = 500
+    with pytest.raises(ValueError, match="window"):
+        preprocess(pd.DataFrame({'latency': values}), window=window, remove_outliers=True)
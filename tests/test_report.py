@@ -0,0 +1,75 @@
+import argparse
+import shutil
+from pathlib import Path
+
+import matplotlib
+matplotlib.use("Agg")
+
+from G2GDelay import report
+
+
+RESULTS = Path(__file__).resolve().parent.parent / "Results"
+
+
+def report_args(directory: Path) -> argparse.Namespace:
+    return argparse.Namespace(
+        directory=directory,
+        output=directory / "report",
+        window=1,
+        nbins=15,
+        percentile=0.95,
+        remove_outliers=False,
+        outlier_method="mad",
+        z_threshold=3,
+        iqr_factor=1.5,
+        segments=False,
+        rolling_range=False,
+    )
+
+
+def build(args, capsys):
+    report.build_report(args)
+    lines = capsys.readouterr().out.splitlines()
+    return {
+        line.split(": ")[1]: line.split(": ")[0]
+        for line in lines if line.startswith(("Analyzed: ", "Cached: "))
+    }
+
+
+def test_only_changed_and_new_runs_are_rebuilt(tmp_path, capsys):
+    for run in ("results_INFER_1080p_PIPE_DLA.csv", "results_INFER_720_PIPE.csv", "results_INFER_1080p_PIPE.csv"):
+        shutil.copy(RESULTS / run, tmp_path / run)
+    args = report_args(tmp_path)
+
+    assert set(build(args, capsys).values()) == {"Analyzed"}
+    assert (args.output / "index.html").exists()
+
+    # Change one run, add one and remove one
+    changed = tmp_path / "results_INFER_720_PIPE.csv"
+    changed.write_text(changed.read_text() + "99.99\n")
+    shutil.copy(RESULTS / "results_infer_1080p_v8l_fp16.csv", tmp_path / "results_infer_1080p_v8l_fp16.csv")
+    (tmp_path / "results_INFER_1080p_PIPE.csv").unlink()
+
+    assert build(args, capsys) == {
+        "results_INFER_1080p_PIPE_DLA.csv": "Cached",
+        "results_INFER_720_PIPE.csv": "Analyzed",
+        "results_infer_1080p_v8l_fp16.csv": "Analyzed",
+    }
+
+    # Only the artifacts of the current runs are left in the cache
+    cached_runs = {path.stem.rsplit("-", 1)[0] for path in (args.output / "cache").iterdir()}
+    assert cached_runs == {"results_INFER_1080p_PIPE_DLA", "results_INFER_720_PIPE", "results_infer_1080p_v8l_fp16"}
+    assert len(list((args.output / "cache").iterdir())) == 6
+
+
+def test_analysis_code_change_invalidates_cache(tmp_path, monkeypatch):
+    module_file = tmp_path / "analysis.py"
+    module_file.write_text("THRESHOLD = 8\n")
+    monkeypatch.setattr(report, "ANALYSIS_MODULES", (argparse.Namespace(__file__=str(module_file)),))
+    args = report_args(tmp_path)
+    csv_file = tmp_path / "run.csv"
+    shutil.copy(RESULTS / "results_INFER_1080p_PIPE_DLA.csv", csv_file)
+
+    key = report.run_hash(csv_file, report.analysis_parameters(args))
+    module_file.write_text("THRESHOLD = 10\n")
+    assert report.run_hash(csv_file, report.analysis_parameters(args)) != key